@@ -1,9 +1,19 @@
+import io
 import os
+import base64
 import json
+import asyncio
+import hashlib
 import logging
-from typing import Dict, Any
-from PIL import Image
+import msgspec
+import orjson
+from pathlib import Path
+from typing import Dict, Any, Literal, Optional, Tuple, get_args
+from PIL import Image, ImageOps
 import google.generativeai as genai
+from cachetools import TTLCache
+from google.api_core import exceptions as google_exceptions
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
 
 logging.basicConfig(
@@ -18,6 +28,55 @@ class ConfigurationError(Exception):
 class APIResponseError(Exception):
     pass
 
+
+# Rate limiting (429) and transient server-side failures (5xx) worth retrying.
+RETRYABLE_EXCEPTIONS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+)
+
+
+Severity = Literal['high', 'medium', 'low', 'none']
+
+
+class AIResult(msgspec.Struct):
+    """Gemini's classification, validated while decoding."""
+    # issue_type depends on mapping.json, so it is checked after decoding instead.
+    issue_type: str
+    severity: Severity
+    confidence: float
+    description: str
+
+
+# Longest side sent to Gemini; larger images only add upload time and vision tokens.
+MAX_IMAGE_SIDE = 1024
+
+# Pixel budget for decoding. File size says little about decoded size: a ~200 KB
+# PNG can hold 81 megapixels (hundreds of MB once decoded).
+MAX_IMAGE_PIXELS = 50_000_000
+
+# Seconds startup waits for the best-effort Gemini warm-up before giving up.
+WARM_UP_TIMEOUT = 5
+
+# 1x1 PNG decoded at startup to load PIL's codecs before the first request.
+_WARM_UP_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+
+def sniff_image_mime(data: bytes) -> Optional[str]:
+    """Detect a supported image MIME type from its magic bytes."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
 class CivicIssueAnalyzer:
     """
     Analyzer for civic issues using Gemini AI and local mapping.json.
@@ -27,7 +86,16 @@ class CivicIssueAnalyzer:
         if not api_key:
             raise ConfigurationError("Google API key not provided.")
         genai.configure(api_key=api_key)
+        # One model per process: every request reuses its client and connection.
         self.model = genai.GenerativeModel('gemini-2.5-flash')
+        self._sem = asyncio.Semaphore(int(os.getenv("GEMINI_CONCURRENCY", "10")))
+        # Downscaling is CPU-bound, so it gets its own limit instead of taking Gemini slots.
+        self._decode_sem = asyncio.Semaphore(os.cpu_count() or 1)
+        # Results keyed by image content hash, so repeat uploads skip Gemini.
+        self._cache = TTLCache(
+            maxsize=int(os.getenv("ANALYSIS_CACHE_SIZE", "10000")),
+            ttl=int(os.getenv("ANALYSIS_CACHE_TTL", "3600")),
+        )
 
 
         try:
@@ -41,9 +109,35 @@ class CivicIssueAnalyzer:
 
 
         self.VALID_ISSUE_TYPES = list(self.mapping_data.keys())
-        self.VALID_SEVERITY = ['high', 'medium', 'low', 'none']
+        self.VALID_SEVERITY = list(get_args(Severity))
+        self._issue_type_set = frozenset(self.VALID_ISSUE_TYPES)
+        # Department/responsible fields per issue type, resolved once instead of per response.
+        self._default_routing = {"department": "N/A", "responsible": "N/A"}
+        self._routing = {
+            issue_type: {
+                "department": details.get("department", "N/A"),
+                "responsible": details.get("responsible", "N/A"),
+            }
+            for issue_type, details in self.mapping_data.items()
+        }
+        self._prompt = self._build_prompt_string()
+        # Constrain Gemini to JSON matching this schema, so no fence stripping is needed.
+        self._generation_config = {
+            "temperature": 0.2,
+            "response_mime_type": "application/json",
+            "response_schema": {
+                "type": "object",
+                "properties": {
+                    "issue_type": {"type": "string", "format": "enum", "enum": self.VALID_ISSUE_TYPES},
+                    "severity": {"type": "string", "format": "enum", "enum": self.VALID_SEVERITY},
+                    "confidence": {"type": "number"},
+                    "description": {"type": "string"},
+                },
+                "required": ["issue_type", "severity", "confidence", "description"],
+            },
+        }
 
-    def _create_prompt(self) -> str:
+    def _build_prompt_string(self) -> str:
         """Prompt Gemini to output a valid JSON with description."""
         return f"""
         You are an AI for a civic monitoring app. Analyze the image and classify the primary issue.
@@ -57,47 +151,129 @@ class CivicIssueAnalyzer:
         Respond only with the raw JSON.
         """
 
-    def _validate_ai_response(self, response_text: str) -> Dict[str, Any]:
+    def _create_prompt(self) -> str:
+        """Return the prompt built once in __init__."""
+        return self._prompt
+
+    def _validate_ai_response(self, response_text: str) -> AIResult:
         """Parse and validate Gemini's JSON response."""
         try:
-            clean_text = response_text.strip().replace("```json", "").replace("```", "").strip()
-            data = json.loads(clean_text)
-        except json.JSONDecodeError:
+            result = msgspec.json.decode(response_text, type=AIResult)
+        except msgspec.ValidationError as e:
+            raise APIResponseError(f"Invalid AI response ({e}): {response_text}")
+        except msgspec.DecodeError:
             raise APIResponseError(f"Failed to parse JSON from AI response: {response_text}")
 
 
-        required_keys = ['issue_type', 'severity', 'confidence', 'description']
-        for key in required_keys:
-            if key not in data:
-                raise APIResponseError(f"Missing key '{key}' in AI response: {data}")
+        if result.issue_type not in self._issue_type_set:
+            logging.warning(f"Invalid category '{result.issue_type}', defaulting to 'unknown_issue'")
+            result.issue_type = "unknown_issue"
+
+        # The response schema can't express a range, so clamp rather than discard
+        # an otherwise valid classification.
+        if not 0.0 <= result.confidence <= 1.0:
+            logging.warning(f"Confidence {result.confidence} out of range, clamping to [0, 1]")
+            result.confidence = min(max(result.confidence, 0.0), 1.0)
+
+        return result
+
+    @retry(
+        retry=retry_if_exception_type(RETRYABLE_EXCEPTIONS),
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=1, max=10),
+        reraise=True,
+    )
+    async def _generate(self, contents):
+        """Call Gemini, bounded by the concurrency semaphore."""
+        async with self._sem:
+            return await self.model.generate_content_async(contents, generation_config=self._generation_config)
 
+    async def warm_up(self) -> None:
+        """Load image/JSON codecs and open the Gemini connection ahead of the first request."""
+        with Image.open(io.BytesIO(_WARM_UP_PNG)) as img:
+            img.load()
+        orjson.loads(orjson.dumps({"ok": 1}))
 
-        if data['issue_type'] not in self.VALID_ISSUE_TYPES:
-            logging.warning(f"Invalid category '{data['issue_type']}', defaulting to 'unknown_issue'")
-            data['issue_type'] = "unknown_issue"
+        try:
+            # Token counting is free and still sets up the client and TLS session.
+            await asyncio.wait_for(self.model.count_tokens_async("ping"), timeout=WARM_UP_TIMEOUT)
+            logging.info("Gemini connection warmed up.")
+        except asyncio.TimeoutError:
+            logging.warning(f"Gemini warm-up timed out after {WARM_UP_TIMEOUT}s; continuing startup.")
+        except Exception as e:
+            logging.warning(f"Gemini warm-up failed: {e}")
 
-        return data
+    def _prepare_image(self, data: bytes, mime_type: str) -> Tuple[bytes, str]:
+        """Downscale images larger than MAX_IMAGE_SIDE and re-encode them as JPEG."""
+        with Image.open(io.BytesIO(data)) as img:
+            # Only the header has been read so far, so this check is cheap.
+            width, height = img.size
+            if width * height > MAX_IMAGE_PIXELS:
+                raise ValueError(
+                    f"Image too large: {width}x{height} pixels (max {MAX_IMAGE_PIXELS} pixels)."
+                )
+            if max(img.size) <= MAX_IMAGE_SIDE:
+                return data, mime_type
+            # Lets libjpeg decode at a reduced scale; ignored for other formats.
+            img.draft("RGB", (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+            img.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.LANCZOS)
+            # The re-encoded JPEG carries no EXIF, so apply the Orientation tag to the
+            # pixels. Done after thumbnail so only the small image is copied.
+            img = ImageOps.exif_transpose(img)
+            if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+                # JPEG has no alpha channel; flatten onto white instead of dropping it.
+                rgba = img.convert("RGBA")
+                img = Image.new("RGB", rgba.size, (255, 255, 255))
+                img.paste(rgba, mask=rgba.getchannel("A"))
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=85)
+        return buf.getvalue(), "image/jpeg"
 
-    def analyze_image(self, image_path: str) -> Dict[str, Any]:
-        """Analyze image and enrich result with mapping.json details."""
+    async def analyze_image(self, image_path: str) -> Dict[str, Any]:
+        """Analyze image file on disk; see analyze_bytes."""
         logging.info(f"Analyzing image: {image_path}")
-        if not os.path.exists(image_path):
+        try:
+            # Read in a worker thread so the event loop isn't blocked on disk I/O.
+            data = await asyncio.to_thread(Path(image_path).read_bytes)
+        except FileNotFoundError:
             return {"error": "Image file not found."}
 
+        return await self.analyze_bytes(data)
+
+    async def analyze_bytes(self, data: bytes, mime_type: Optional[str] = None) -> Dict[str, Any]:
+        """Analyze in-memory image bytes, serving repeat images from the cache."""
+        key = hashlib.blake2b(data, digest_size=16).hexdigest()
+        cached = self._cache.get(key)
+        if cached is not None:
+            logging.info(f"Cache hit for image {key}")
+            return dict(cached)
+
+        result = await self._analyze(data, mime_type)
+        if "error" not in result:
+            self._cache[key] = result
+        return dict(result)
+
+    async def _analyze(self, data: bytes, mime_type: Optional[str]) -> Dict[str, Any]:
+        """Analyze in-memory image bytes and enrich result with mapping.json details."""
+        mime_type = mime_type or sniff_image_mime(data)
+        if mime_type is None:
+            return {"error": "Unsupported image format."}
+
         try:
-            with Image.open(image_path) as img:
-                prompt = self._create_prompt()
-                response = self.model.generate_content([prompt, img], generation_config={"temperature": 0.2})
+            # Gemini accepts the encoded image directly; PIL only decodes oversized ones.
+            async with self._decode_sem:
+                data, mime_type = await asyncio.to_thread(self._prepare_image, data, mime_type)
+            prompt = self._create_prompt()
+            response = await self._generate([prompt, {"mime_type": mime_type, "data": data}])
 
             ai_result = self._validate_ai_response(response.text)
 
 
-            category = ai_result['issue_type']
-            mapping_details = self.mapping_data.get(category, {})
             final_result = {
-                **ai_result,
-                "department": mapping_details.get("department", "N/A"),
-                "responsible": mapping_details.get("responsible", "N/A")
+                **msgspec.structs.asdict(ai_result),
+                **self._routing.get(ai_result.issue_type, self._default_routing),
             }
 
             return final_result
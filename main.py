@@ -1,11 +1,13 @@
 import os
+import re
+import asyncio
 import uvicorn
-import tempfile
+from typing import List, Tuple
 from fastapi import FastAPI, UploadFile, File, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-from analyzer import CivicIssueAnalyzer, ConfigurationError, APIResponseError
+from analyzer import CivicIssueAnalyzer, ConfigurationError, APIResponseError, sniff_image_mime
 
 
 jharkhand_districts = [
@@ -15,13 +17,25 @@ jharkhand_districts = [
     "Sahebganj", "Saraikela Kharsawan", "Simdega", "West Singhbhum"
 ]
 
+# Lowercased names and a single alternation so an address is scanned once. The
+# lookahead capture reports overlapping matches (e.g. "ramgarhwa" holds Ramgarh
+# and Garhwa); no district name is a prefix of another, so none are missed.
+_district_by_lower = {d.lower(): d for d in jharkhand_districts}
+_district_rank = {name: i for i, name in enumerate(_district_by_lower)}
+_district_pattern = re.compile("(?=(" + "|".join(map(re.escape, _district_by_lower)) + "))")
+
 def classify_location(address: str) -> str:
     address_lower = address.lower()
     if "jharkhand" not in address_lower:
         return "Not in Jharkhand"
-    for district in jharkhand_districts:
-        if district.lower() in address_lower:
-            return district
+    # If several districts appear, the one listed first in jharkhand_districts wins.
+    match = min(
+        (m.group(1) for m in _district_pattern.finditer(address_lower)),
+        key=_district_rank.__getitem__,
+        default=None,
+    )
+    if match:
+        return _district_by_lower[match]
     return "Jharkhand (District Unknown)"
 
 load_dotenv()
@@ -30,10 +44,62 @@ if not GOOGLE_API_KEY:
     raise ConfigurationError("Google API key not found in .env file. Please add GOOGLE_API_KEY.")
 
 
+max_file_size = 5 * 1024 * 1024  # 5 MB
+max_batch_files = 10
+max_batch_size = 20 * 1024 * 1024  # 20 MB across a whole batch
+upload_chunk_size = 64 * 1024
+multipart_overhead = 64 * 1024  # slack for multipart boundaries and part headers
+
+
+class BodySizeLimitMiddleware:
+    """
+    Reject request bodies over a per-path limit before FastAPI parses the form.
+    A declared Content-Length is checked up front; chunked bodies are counted as they arrive.
+    """
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            response = ORJSONResponse({"detail": "Request body too large."}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # FastAPI re-raises HTTPExceptions from body parsing, so this becomes a 413.
+                    raise HTTPException(status_code=413, detail="Request body too large.")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
 app = FastAPI(
     title="Indian Civic Issue Analyzer API",
     description="API for analyzing civic issues from uploaded images using Gemini AI.",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
+)
+
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={
+        "/analyze": max_file_size + multipart_overhead,
+        "/analyze-batch": max_batch_size + multipart_overhead,
+    },
 )
 
 app.add_middleware(
@@ -44,46 +110,54 @@ app.add_middleware(
         "http://10.0.2.16:19006"
     ],
     allow_credentials=True,
-    allow_methods=["*"],
+    allow_methods=["GET", "POST"],
     allow_headers=["*"],
 )
 
 
 analyzer = CivicIssueAnalyzer(api_key=GOOGLE_API_KEY)
 
+
+@app.on_event("startup")
+async def warm_up():
+    """Prime codecs and connect to Gemini so the first request skips that cost."""
+    await analyzer.warm_up()
+
 @app.get("/")
 def root():
     """Root endpoint to check API status."""
     return {"message": "Indian Civic Issue Analyzer API is running"}
 
 
+async def read_upload(file: UploadFile) -> Tuple[bytes, str]:
+    """Validate an uploaded image and return its contents and MIME type."""
+    # The type is taken from the file's magic bytes; the client-supplied name is not trusted.
+    contents = bytearray(await file.read(upload_chunk_size))
+    mime_type = sniff_image_mime(contents)
+    if mime_type is None:
+        raise HTTPException(status_code=400, detail="Invalid file type. Only images are allowed.")
+    # Read in chunks so an oversized file is never fully copied into memory; the
+    # request body itself is capped earlier by BodySizeLimitMiddleware.
+    while chunk := await file.read(upload_chunk_size):
+        contents.extend(chunk)
+        if len(contents) > max_file_size:
+            raise HTTPException(status_code=413, detail="File too large. Max size is 5MB.")
+    return bytes(contents), mime_type
+
+
 @app.post("/analyze")
 async def analyze_image(file: UploadFile = File(...)):
     """
     Upload an image to analyze the civic issue.
     """
-    allowed_extensions = {".jpg", ".jpeg", ".png", ".webp"}
-    max_file_size = 5 * 1024 * 1024  # 5 MB
-    suffix = os.path.splitext(file.filename)[1].lower()
-    if suffix not in allowed_extensions:
-        raise HTTPException(status_code=400, detail="Invalid file type. Only images are allowed.")
-    contents = await file.read()
-    if len(contents) > max_file_size:
-        raise HTTPException(status_code=400, detail="File too large. Max size is 5MB.")
+    contents, mime_type = await read_upload(file)
 
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
-            tmp_file.write(contents)
-            tmp_file_path = tmp_file.name
-
-        result = analyzer.analyze_image(tmp_file_path)
-
-        if os.path.exists(tmp_file_path):
-            os.remove(tmp_file_path)
+        result = await analyzer.analyze_bytes(contents, mime_type)
 
         if "error" in result:
             raise HTTPException(status_code=500, detail="Analysis failed.")
-        return JSONResponse(content=result)
+        return result
 
     except (ConfigurationError, APIResponseError):
         raise HTTPException(status_code=400, detail="Configuration or API error.")
@@ -91,6 +165,38 @@ async def analyze_image(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail="Unexpected server error.")
 
 
+@app.post("/analyze-batch")
+async def analyze_batch(files: List[UploadFile] = File(...)):
+    """
+    Upload several images and analyze them concurrently.
+    Results keep the upload order; a failing image does not fail the batch.
+    """
+    # Bound per-request memory before any file is read into it.
+    if len(files) > max_batch_files:
+        raise HTTPException(status_code=413, detail=f"Too many files. Max is {max_batch_files} per batch.")
+    if sum(f.size or 0 for f in files) > max_batch_size:
+        raise HTTPException(status_code=413, detail="Batch too large. Max total size is 20MB.")
+
+    uploads = await asyncio.gather(*(read_upload(f) for f in files), return_exceptions=True)
+
+    async def analyze(upload):
+        if isinstance(upload, Exception):
+            return upload
+        return await analyzer.analyze_bytes(*upload)
+
+    results = await asyncio.gather(*(analyze(u) for u in uploads), return_exceptions=True)
+
+    items = []
+    for result in results:
+        if isinstance(result, HTTPException):
+            items.append({"ok": False, "error": result.detail})
+        elif isinstance(result, Exception) or "error" in result:
+            items.append({"ok": False, "error": "Analysis failed."})
+        else:
+            items.append({"ok": True, "result": result})
+    return items
+
+
 @app.get("/classify-district")
 def classify_district(address: str = Query(..., description="Full location address")):
     """
@@ -100,5 +206,16 @@ def classify_district(address: str = Query(..., description="Full location addre
     return {"address": address, "district": district}
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # Auto-reload only supports a single worker, so keep it for development.
+    reload = os.getenv("DEV_RELOAD", "").lower() in {"1", "true", "yes"}
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        # "auto" picks uvloop/httptools when installed (uvicorn[standard], not on Windows).
+        loop="auto",
+        http="auto",
+        workers=1 if reload else int(os.getenv("WEB_CONCURRENCY", "4")),
+        reload=reload,
+    )
 
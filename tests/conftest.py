@@ -0,0 +1,11 @@
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# main.py builds the analyzer at import time: it needs an API key and loads
+# mapping.json relative to the working directory. No Gemini call is made.
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+os.chdir(ROOT)
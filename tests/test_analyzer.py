@@ -0,0 +1,186 @@
+import io
+import json
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+from google.api_core import exceptions as google_exceptions
+from tenacity import wait_none
+
+from analyzer import CivicIssueAnalyzer, sniff_image_mime
+
+VALID_REPLY = '{"issue_type": "pothole", "severity": "high", "confidence": 0.9, "description": "A pothole."}'
+
+
+class FakeModel:
+    """Replays canned Gemini replies; an exception in the list is raised instead."""
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.calls = []
+
+    async def generate_content_async(self, contents, generation_config=None):
+        self.calls.append(contents)
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if isinstance(reply, Exception):
+            raise reply
+        return SimpleNamespace(text=reply)
+
+
+def make_image(size=(8, 8), mode="RGB", color=(255, 0, 0), format="PNG", **save_kwargs):
+    buf = io.BytesIO()
+    Image.new(mode, size, color).save(buf, format=format, **save_kwargs)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def make_analyzer():
+    def make(*replies):
+        analyzer = CivicIssueAnalyzer(api_key="test-key")
+        analyzer.model = FakeModel(*replies)
+        return analyzer
+    return make
+
+
+@pytest.mark.parametrize("data, expected", [
+    (b"\xff\xd8\xff\xe0\x00\x10JFIF", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR", "image/png"),
+    (b"RIFF\x24\x00\x00\x00WEBPVP8 ", "image/webp"),
+    (b"RIFF\x24\x00\x00\x00WAVEfmt ", None),
+    (b"GIF89a\x01\x00\x01\x00", None),
+    (b"%PDF-1.7", None),
+    (b"", None),
+])
+def test_sniff_image_mime(data, expected):
+    assert sniff_image_mime(data) == expected
+
+
+def test_retries_transient_gemini_errors(make_analyzer, monkeypatch):
+    monkeypatch.setattr(CivicIssueAnalyzer._generate.retry, "wait", wait_none())
+    analyzer = make_analyzer(google_exceptions.ServiceUnavailable("busy"), VALID_REPLY)
+
+    result = asyncio.run(analyzer.analyze_bytes(make_image()))
+
+    assert result["issue_type"] == "pothole"
+    assert len(analyzer.model.calls) == 2
+
+
+def test_gives_up_after_three_attempts(make_analyzer, monkeypatch):
+    monkeypatch.setattr(CivicIssueAnalyzer._generate.retry, "wait", wait_none())
+    analyzer = make_analyzer(google_exceptions.ServiceUnavailable("busy"))
+
+    result = asyncio.run(analyzer.analyze_bytes(make_image()))
+
+    assert "error" in result
+    assert len(analyzer.model.calls) == 3
+
+
+def test_cache_hit_skips_model_call(make_analyzer):
+    analyzer = make_analyzer(VALID_REPLY)
+    image = make_image()
+
+    first = asyncio.run(analyzer.analyze_bytes(image))
+    second = asyncio.run(analyzer.analyze_bytes(image))
+
+    assert first == second
+    assert len(analyzer.model.calls) == 1
+
+
+def test_errors_are_not_cached(make_analyzer):
+    analyzer = make_analyzer("not json", VALID_REPLY)
+    image = make_image()
+
+    assert "error" in asyncio.run(analyzer.analyze_bytes(image))
+    assert asyncio.run(analyzer.analyze_bytes(image))["issue_type"] == "pothole"
+    assert len(analyzer.model.calls) == 2
+
+
+def sent_image(analyzer):
+    """Decode the image part of the last request sent to the fake model."""
+    part = analyzer.model.calls[-1][1]
+    return part["mime_type"], Image.open(io.BytesIO(part["data"]))
+
+
+def test_small_images_are_sent_unchanged(make_analyzer):
+    analyzer = make_analyzer(VALID_REPLY)
+    image = make_image(size=(640, 480))
+
+    asyncio.run(analyzer.analyze_bytes(image))
+
+    assert analyzer.model.calls[0][1] == {"mime_type": "image/png", "data": image}
+
+
+def test_large_images_are_downscaled_to_jpeg(make_analyzer):
+    analyzer = make_analyzer(VALID_REPLY)
+
+    asyncio.run(analyzer.analyze_bytes(make_image(size=(4000, 2000))))
+
+    mime_type, img = sent_image(analyzer)
+    assert mime_type == "image/jpeg"
+    assert img.size == (1024, 512)
+
+
+def test_downscaling_applies_exif_orientation(make_analyzer):
+    analyzer = make_analyzer(VALID_REPLY)
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90° clockwise to display
+    image = make_image(size=(4000, 2000), format="JPEG", exif=exif.tobytes())
+
+    asyncio.run(analyzer.analyze_bytes(image))
+
+    _, img = sent_image(analyzer)
+    assert img.size == (512, 1024)
+
+
+def test_downscaling_flattens_alpha_onto_white(make_analyzer):
+    analyzer = make_analyzer(VALID_REPLY)
+
+    asyncio.run(analyzer.analyze_bytes(make_image(size=(2000, 2000), mode="RGBA", color=(255, 0, 0, 0))))
+
+    _, img = sent_image(analyzer)
+    assert img.mode == "RGB"
+    r, g, b = img.getpixel((512, 512))
+    assert min(r, g, b) > 250
+
+
+def test_rejects_images_over_pixel_cap(make_analyzer):
+    analyzer = make_analyzer(VALID_REPLY)
+    image = make_image(size=(9000, 9000), mode="1", color=0)
+
+    result = asyncio.run(analyzer.analyze_bytes(image))
+
+    assert "Image too large" in result["error"]
+    assert analyzer.model.calls == []
+
+
+def reply(**overrides):
+    fields = {"issue_type": "pothole", "severity": "high", "confidence": 0.9, "description": "A pothole."}
+    fields.update(overrides)
+    return json.dumps(fields)
+
+
+def test_invalid_severity_is_rejected(make_analyzer):
+    analyzer = make_analyzer(reply(severity="catastrophic"))
+
+    result = asyncio.run(analyzer.analyze_bytes(make_image()))
+
+    assert "severity" in result["error"]
+
+
+def test_unknown_issue_type_falls_back(make_analyzer):
+    analyzer = make_analyzer(reply(issue_type="alien_landing"))
+
+    result = asyncio.run(analyzer.analyze_bytes(make_image()))
+
+    assert result["issue_type"] == "unknown_issue"
+    assert result["department"] == "N/A"
+
+
+@pytest.mark.parametrize("confidence, expected", [(85, 1.0), (-0.2, 0.0), (0.4, 0.4)])
+def test_confidence_is_clamped(make_analyzer, confidence, expected):
+    analyzer = make_analyzer(reply(confidence=confidence))
+
+    result = asyncio.run(analyzer.analyze_bytes(make_image()))
+
+    assert result["confidence"] == expected
+    assert result["issue_type"] == "pothole"
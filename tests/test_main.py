@@ -0,0 +1,108 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+JPEG_HEAD = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00"
+PNG_HEAD = b"\x89PNG\r\n\x1a\n"
+
+
+class StubAnalyzer:
+    """Stands in for CivicIssueAnalyzer so no request reaches Gemini."""
+    def __init__(self):
+        self.calls = []
+
+    async def analyze_bytes(self, data, mime_type=None):
+        self.calls.append((len(data), mime_type))
+        return {"issue_type": "pothole", "severity": "high", "confidence": 0.9,
+                "description": "A pothole.", "department": "Roads", "responsible": "N/A"}
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    analyzer = StubAnalyzer()
+    monkeypatch.setattr(main, "analyzer", analyzer)
+    return analyzer
+
+
+@pytest.fixture
+def client():
+    return TestClient(main.app)
+
+
+@pytest.mark.parametrize("address, expected", [
+    ("Main Road, Ranchi, Jharkhand", "Ranchi"),
+    ("sector 4, BOKARO STEEL CITY, JHARKHAND", "Bokaro"),
+    ("Sakchi, East Singhbhum, Jharkhand", "East Singhbhum"),
+    ("Ranchi Road, Bokaro, Jharkhand", "Bokaro"),
+    ("Ramgarhwa, Jharkhand", "Garhwa"),
+    ("Lohardagarhwa, Jharkhand", "Garhwa"),
+    ("Some village, Jharkhand", "Jharkhand (District Unknown)"),
+    ("Ranchi Road, Patna, Bihar", "Not in Jharkhand"),
+])
+def test_classify_location(address, expected):
+    assert main.classify_location(address) == expected
+
+
+def test_analyze_passes_sniffed_mime(client, stub):
+    response = client.post("/analyze", files={"file": ("photo.txt", PNG_HEAD + b"\x00" * 64)})
+    assert response.status_code == 200
+    assert response.json()["issue_type"] == "pothole"
+    assert stub.calls == [(72, "image/png")]
+
+
+def test_analyze_rejects_non_image_despite_extension(client, stub):
+    response = client.post("/analyze", files={"file": ("photo.jpg", b"%PDF-1.7 not an image")})
+    assert response.status_code == 400
+    assert stub.calls == []
+
+
+def test_analyze_rejects_file_over_limit(client, stub):
+    # Within the multipart slack, so it passes the middleware and hits read_upload's cap.
+    data = JPEG_HEAD + b"\x00" * main.max_file_size
+    response = client.post("/analyze", files={"file": ("photo.jpg", data)})
+    assert response.status_code == 413
+    assert stub.calls == []
+
+
+def test_analyze_rejects_body_over_limit_before_parsing(client, stub):
+    data = JPEG_HEAD + b"\x00" * (main.max_file_size + 2 * main.multipart_overhead)
+    response = client.post("/analyze", files={"file": ("photo.jpg", data)})
+    assert response.status_code == 413
+    assert response.json() == {"detail": "Request body too large."}
+    assert stub.calls == []
+
+
+def test_chunked_body_over_limit_is_rejected(client, stub):
+    # No Content-Length, so the middleware has to count bytes as they arrive.
+    def body():
+        yield b"x" * (main.max_file_size + 2 * main.multipart_overhead)
+
+    response = client.post(
+        "/analyze",
+        content=body(),
+        headers={"Content-Type": "multipart/form-data; boundary=xyz"},
+    )
+    assert response.status_code == 413
+    assert stub.calls == []
+
+
+def test_analyze_batch_reports_per_item_results(client, stub):
+    files = [
+        ("files", ("a.jpg", JPEG_HEAD + b"\x00" * 16)),
+        ("files", ("b.png", b"not an image")),
+        ("files", ("c.png", PNG_HEAD + b"\x00" * 16)),
+    ]
+    response = client.post("/analyze-batch", files=files)
+    assert response.status_code == 200
+    items = response.json()
+    assert [item["ok"] for item in items] == [True, False, True]
+    assert items[1]["error"] == "Invalid file type. Only images are allowed."
+    assert [mime for _, mime in stub.calls] == ["image/jpeg", "image/png"]
+
+
+def test_analyze_batch_rejects_too_many_files(client, stub):
+    files = [("files", (f"{i}.jpg", JPEG_HEAD)) for i in range(main.max_batch_files + 1)]
+    response = client.post("/analyze-batch", files=files)
+    assert response.status_code == 413
+    assert stub.calls == []